@@ -1,153 +1,305 @@
 import streamlit as st
+import asyncio
+import itertools
 import logging
-import os
+import re
+import threading
+import time
 
-import google.generativeai as genai
-# Import necessary types for GenerationConfig and safety settings
-from google.generativeai.types import GenerationConfig, HarmCategory, HarmBlockThreshold
+from providers import BATCH_DONE_STATES, MAX_BATCHED_OUTPUT_TOKENS, MAX_OUTPUT_TOKENS, RECIPES_END, BatchProvider, load_provider
 
 # Basic logging setup
-logging.basicConfig(level=logging.INFO)
+@st.cache_resource
+def setup_logging():
+    """
+    Configures the root logger once per process instead of on every rerun,
+    so handlers are never stacked up as the script reruns.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+setup_logging()
+
+# Output budget: decode time grows with max_output_tokens, so size it to the recipes asked for
+TOKENS_PER_RECIPE = 500
+MAX_RECIPES_PER_QUERY = MAX_OUTPUT_TOKENS // TOKENS_PER_RECIPE
+MAX_RECIPES_PER_REQUEST = MAX_BATCHED_OUTPUT_TOKENS // TOKENS_PER_RECIPE
+
+def recipe_token_budget(num_recipes, num_queries):
+    """Returns max_output_tokens for num_recipes recipes per query, capped at MAX_BATCHED_OUTPUT_TOKENS."""
+    return min(MAX_BATCHED_OUTPUT_TOKENS, num_recipes * max(num_queries, 1) * TOKENS_PER_RECIPE)
+
+# Prompt templates, filled in by build_prompt only when the form is submitted
+PROMPT_TEMPLATE = """I am a Chef. I need to create {cuisine}
+recipes for customers who want {dietary_preference} meals.
+However, don't include recipes that use ingredients with the customer's {allergy} allergy.
+I have {ingredient_1}, {ingredient_2}, and {ingredient_3}
+in my kitchen and other ingredients.
+The customer's wine preference is {wine}.
+Please provide {num_recipes} meal recommendations.
+For each recommendation include preparation instructions,
+time to prepare, and the recipe title at the beginning of the response.
+Then include the wine pairing for each recommendation.
+At the end of the recommendation provide the calories associated with the meal
+and the nutritional facts.
+After the last recommendation, write {recipes_end} on its own line.
+"""
 
-# --- API Key Configuration ---
-api_key_env = os.environ.get("GEMINI_API_KEY")
+# Same request for several cuisine/diet combinations, answered in ###query_N### blocks
+BATCHED_PROMPT_TEMPLATE = """I am a Chef. For each query below, produce a full recipe block
+with recipes of the query's cuisine for customers who want meals of the query's diet.
+However, don't include recipes that use ingredients with the customer's {allergy} allergy.
+I have {ingredient_1}, {ingredient_2}, and {ingredient_3}
+in my kitchen and other ingredients.
+The customer's wine preference is {wine}.
+Please provide {num_recipes} meal recommendations for each query.
+For each recommendation include preparation instructions,
+time to prepare, and the recipe title at the beginning of the response.
+Then include the wine pairing for each recommendation.
+At the end of the recommendation provide the calories associated with the meal
+and the nutritional facts.
+Start the block for query N with a line containing only ###query_N###.
+After the last query's block, write {recipes_end} on its own line.
 
-if not api_key_env:
-    st.error("Gemini API Key not found. Please set 'GEMINI_API_KEY' as an environment variable.")
-    st.stop()
-else:
-    genai.configure(api_key=api_key_env)
-    logging.info("Gemini API Key loaded from environment variable.")
+{query_lines}
+"""
 
 @st.cache_resource
-def load_models():
+def load_event_loop():
     """
-    Loads the Gemini generative model. Prefers gemini-1.5-flash-latest,
-    falls back to gemini-pro if the preferred model is not accessible.
+    Starts one background event loop shared by all sessions to run the async
+    Gemini calls. The script thread still waits on each result, so this only
+    moves the I/O; chef.py draws the rest of the page before generating.
     """
-    model_name_flash = "gemini-1.5-flash-latest"
-    model_name_pro = "gemini-pro"
-    model = None
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
 
-    try:
-        model = genai.GenerativeModel(model_name_flash)
-        logging.info(f"Successfully loaded model: {model_name_flash}")
-    except Exception as e:
-        logging.warning(f"Failed to load {model_name_flash}: {e}. Falling back to {model_name_pro}.")
+def run_on_loop(coroutine):
+    """Runs a coroutine on the background loop and waits for its result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, load_event_loop()).result()
+
+def to_sync_generator(async_generator):
+    """Adapts an async generator running on the background loop into a plain generator."""
+    while True:
         try:
-            model = genai.GenerativeModel(model_name_pro)
-            logging.info(f"Successfully loaded model: {model_name_pro}")
-            if not model:
-                raise Exception("Failed to load any Gemini model.")
-        except Exception as e_pro:
-            logging.error(f"Failed to load {model_name_pro}: {e_pro}. No generative model could be loaded.")
-            st.error("Could not load a generative model. Please check your API key and model availability.")
-            st.stop()
-    return model
+            yield run_on_loop(async_generator.__anext__())
+        except StopAsyncIteration:
+            return
 
 # --- Streamlit UI ---
 st.header("AI Chef powered by Gemini (Vercel Deployment)", divider="gray")
-model_instance = load_models()
+provider = load_provider()
 
-st.write(f"Generating recipes using {model_instance.model_name} (public API)")
+st.write(f"Generating recipes using {provider.model_name} ({provider.description})")
 st.subheader("AI Chef")
 
-# Input fields
-cuisine = st.selectbox(
-    "What cuisine do you desire?",
-    ("American", "Chinese", "French", "Indian", "Italian", "Japanese", "Mexican", "Turkish"),
-    index=None,
-    placeholder="Select your desired cuisine."
-)
+# Input fields, grouped in a form so editing them does not rerun the script until submit
+with st.form("recipe_inputs"):
+    cuisines = st.multiselect(
+        "What cuisine do you desire?",
+        ("American", "Chinese", "French", "Indian", "Italian", "Japanese", "Mexican", "Turkish"),
+        placeholder="Select one or more cuisines to compare."
+    )
 
-dietary_preference = st.selectbox(
-    "Do you have any dietary preferences?",
-    ("Diabetes", "Gluten free", "Halal", "Keto", "Kosher", "Lactose Intolerance", "Paleo", "Vegan", "Vegetarian", "None"),
-    index=None,
-    placeholder="Select your desired dietary preference."
-)
+    dietary_preferences = st.multiselect(
+        "Do you have any dietary preferences?",
+        ("Diabetes", "Gluten free", "Halal", "Keto", "Kosher", "Lactose Intolerance", "Paleo", "Vegan", "Vegetarian", "None"),
+        placeholder="Select one or more dietary preferences to compare."
+    )
+
+    allergy = st.text_input("Enter your food allergy:   \n\n", key="allergy", value="peanuts")
+    ingredient_1 = st.text_input("Enter your first ingredient:   \n\n", key="ingredient_1", value="ahi tuna")
+    ingredient_2 = st.text_input("Enter your second ingredient:   \n\n", key="ingredient_2", value="chicken breast")
+    ingredient_3 = st.text_input("Enter your third ingredient:   \n\n", key="ingredient_3", value="tofu")
 
-allergy = st.text_input("Enter your food allergy:   \n\n", key="allergy", value="peanuts")
-ingredient_1 = st.text_input("Enter your first ingredient:   \n\n", key="ingredient_1", value="ahi tuna")
-ingredient_2 = st.text_input("Enter your second ingredient:   \n\n", key="ingredient_2", value="chicken breast")
-ingredient_3 = st.text_input("Enter your third ingredient:   \n\n", key="ingredient_3", value="tofu")
+    # Wine Preference Radio Button
+    wine = st.radio("Wine Preference", ("Red", "White", "None"))
 
-# Wine Preference Radio Button
-wine = st.radio("Wine Preference", ("Red", "White", "None"))
+    # Number of drafts generated from a single request
+    num_drafts = st.slider("How many recipe drafts?", min_value=1, max_value=3, value=1)
+
+    # Number of recipes per cuisine/diet combination, which also sets the output budget
+    num_recipes = st.slider(
+        "How many recipes?", min_value=1, max_value=MAX_RECIPES_PER_QUERY, value=2,
+        help=f"Per cuisine/diet combination, at most {MAX_RECIPES_PER_REQUEST} recipes in total across combinations."
+    )
+
+    # Batch mode queues the request instead of waiting for it
+    queue_batch = isinstance(provider, BatchProvider) and st.checkbox(
+        "Queue recipes for later (Batch API, about half the cost)", key="queue_batch"
+    )
+
+    submitted = st.form_submit_button("Generate my recipes.")
+
+# Every cuisine/diet combination is answered by the same request
+queries = list(itertools.product(cuisines, dietary_preferences))
 
 # Prompt
-prompt = f"""I am a Chef. I need to create {cuisine}
-recipes for customers who want {dietary_preference} meals.
-However, don't include recipes that use ingredients with the customer's {allergy} allergy.
-I have {ingredient_1}, {ingredient_2}, and {ingredient_3}
-in my kitchen and other ingredients.
-The customer's wine preference is {wine}.
-Please provide some meal recommendations.
-For each recommendation include preparation instructions,
-time to prepare, and the recipe title at the beginning of the response.
-Then include the wine pairing for each recommendation.
-At the end of the recommendation provide the calories associated with the meal
-and the nutritional facts.
-"""
+def build_prompt(queries, allergy, ingredient_1, ingredient_2, ingredient_3, wine, num_recipes):
+    fields = dict(
+        allergy=allergy,
+        ingredient_1=ingredient_1,
+        ingredient_2=ingredient_2,
+        ingredient_3=ingredient_3,
+        wine=wine,
+        num_recipes=num_recipes,
+        recipes_end=RECIPES_END
+    )
+    if len(queries) > 1:
+        query_lines = "\n".join(
+            f"[query{i}] cuisine={query_cuisine} diet={query_diet}"
+            for i, (query_cuisine, query_diet) in enumerate(queries, start=1)
+        )
+        return BATCHED_PROMPT_TEMPLATE.format(query_lines=query_lines, **fields)
+    cuisine, dietary_preference = queries[0] if queries else (None, None)
+    return PROMPT_TEMPLATE.format(cuisine=cuisine, dietary_preference=dietary_preference, **fields)
 
-# Generation config (without safety_settings)
-config = GenerationConfig(
-    temperature=0.8,
-    max_output_tokens=2048
+# Streamed text is pushed to the page once STREAM_FLUSH_SECONDS have passed, which
+# is longer than Gemini's usual gap between chunks so slow streams still get
+# coalesced. STREAM_FLUSH_CHUNKS caps how far the page lags behind a fast burst.
+STREAM_FLUSH_SECONDS = 0.25
+STREAM_FLUSH_CHUNKS = 10
+
+def stream_markdown(placeholder, chunks):
+    """Renders streamed chunks into a placeholder in batched updates and returns the full text."""
+    text = ""
+    pending = []
+    last_flush = time.monotonic()
+    for chunk in chunks:
+        pending.append(chunk)
+        now = time.monotonic()
+        if now - last_flush >= STREAM_FLUSH_SECONDS or len(pending) >= STREAM_FLUSH_CHUNKS:
+            # Join only the new chunks onto the text already on the page
+            text += "".join(pending)
+            pending.clear()
+            placeholder.markdown(text)
+            last_flush = now
+    if pending:
+        text += "".join(pending)
+        placeholder.markdown(text)
+    return text
+
+# Split a batched response back into one recipe block per query
+def split_batched_response(text, num_queries):
+    parts = re.split(r"###query_(\d+)###", text)
+    blocks = {int(number): block.strip() for number, block in zip(parts[1::2], parts[2::2])}
+    return [blocks.get(i, "") for i in range(1, num_queries + 1)]
+
+# Render a response, one expander per query when several were batched together
+def render_recipes(text, queries):
+    if len(queries) > 1:
+        for (query_cuisine, query_diet), block in zip(queries, split_batched_response(text, len(queries))):
+            with st.expander(f"{query_cuisine} / {query_diet}"):
+                st.markdown(block or "No recipe was returned for this combination.")
+    else:
+        st.markdown(text)
+
+class EmptyResponseError(Exception):
+    """Raised by generate_recipe so an empty response is never cached."""
+
+# Generate and render the recipes for one prompt. The prompt already encodes
+# every form input, so it is the cache key along with the draft count and
+# token budget. Elements drawn here are replayed by Streamlit on a cache hit,
+# so repeat inputs skip Gemini.
+@st.cache_data(ttl=24 * 60 * 60, max_entries=256, show_spinner=False)
+def generate_recipe(prompt, queries, num_drafts, max_output_tokens) -> str:
+    if num_drafts > 1 or len(queries) > 1:
+        drafts = run_on_loop(provider.drafts(prompt, num_drafts, max_output_tokens))
+        if drafts:
+            draft_tabs = st.tabs([f"Draft {i}" for i in range(1, len(drafts) + 1)])
+            for draft_tab, draft in zip(draft_tabs, drafts):
+                with draft_tab:
+                    render_recipes(draft, queries)
+        response = "\n\n".join(drafts)
+    else:
+        recipe_placeholder = st.empty()
+        response = stream_markdown(recipe_placeholder, to_sync_generator(
+            provider.stream(prompt, num_drafts, max_output_tokens)
+        ))
+    # Empty output (safety filter, blocked prompt) may be transient, so raise
+    # instead of returning: st.cache_data does not cache exceptions.
+    if not response.strip():
+        raise EmptyResponseError("Gemini returned no recipe text.")
+    logging.info(response)
+    return response
+
+# Only spend a request when the form is complete
+inputs_complete = bool(queries) and any(
+    ingredient.strip() for ingredient in (ingredient_1, ingredient_2, ingredient_3)
+)
+
+inputs = dict(
+    allergy=allergy,
+    ingredient_1=ingredient_1,
+    ingredient_2=ingredient_2,
+    ingredient_3=ingredient_3,
+    wine=wine,
+    num_recipes=num_recipes
 )
 
-# Safety settings defined separately
-safety_settings = [
-    {
-        "category": HarmCategory.HARM_CATEGORY_HARASSMENT,
-        "threshold": HarmBlockThreshold.BLOCK_NONE
-    },
-    {
-        "category": HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-        "threshold": HarmBlockThreshold.BLOCK_NONE
-    },
-    {
-        "category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-        "threshold": HarmBlockThreshold.BLOCK_NONE
-    },
-    {
-        "category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-        "threshold": HarmBlockThreshold.BLOCK_NONE
-    }
-]
-
-# Function to get response from Gemini
-def get_gemini_text_response(model, contents, generation_config, safety_settings):
-    responses = model.generate_content(
-        contents,
-        generation_config=generation_config,
-        safety_settings=safety_settings,
-        stream=True
+recipes_tab = None
+
+if submitted and not inputs_complete:
+    st.warning("Please fill cuisine, diet, and at least one ingredient.")
+elif submitted and num_recipes * len(queries) > MAX_RECIPES_PER_REQUEST:
+    # Past this the token budget is clamped and the later recipes get cut off
+    st.warning(
+        f"{num_recipes * len(queries)} recipes don't fit in one request (at most {MAX_RECIPES_PER_REQUEST}). "
+        "Please choose fewer recipes or cuisine/diet combinations."
     )
-    final_response = []
-    for response in responses:
-        if hasattr(response, 'text'):
-            final_response.append(response.text)
-    return " ".join(final_response)
-
-# Button click
-generate_t2t = st.button("Generate my recipes.", key="generate_t2t")
-
-if generate_t2t and prompt:
-    with st.spinner("Generating your recipes using Gemini..."):
-        first_tab1, first_tab2 = st.tabs(["Recipes", "Prompt"])
-        with first_tab1:
-            response = get_gemini_text_response(
-                model=model_instance,
-                contents=prompt,
-                generation_config=config,
-                safety_settings=safety_settings
-            )
-            if response:
-                st.write("Your recipes:")
-                st.markdown(response)
-                logging.info(response)
-            else:
-                st.warning("No response generated. Please try adjusting your inputs.")
-        with first_tab2:
+elif submitted:
+    # Built once per submit and shared by the request and the Prompt tab
+    prompt = build_prompt(queries, **inputs)
+    max_output_tokens = recipe_token_budget(num_recipes, len(queries))
+    if queue_batch:
+        try:
+            st.session_state["batch_job"] = provider.submit_batch([prompt], num_drafts, max_output_tokens)
+        except Exception as e:
+            logging.error(f"Failed to submit batch job: {e}")
+            st.error("Could not queue your recipes. Please try again or turn off batch mode.")
+        else:
+            st.session_state["batch_queries"] = queries
+            st.session_state.pop("batch_results", None)
+            logging.info(f"Submitted batch job: {st.session_state['batch_job']}")
+    else:
+        recipes_tab, prompt_tab = st.tabs(["Recipes", "Prompt"])
+        with recipes_tab:
+            st.write("Your recipes:")
+        with prompt_tab:
             st.text(prompt)
+
+# Poll the queued batch job on every rerun until it finishes
+if "batch_job" in st.session_state:
+    try:
+        batch_job = provider.get_batch_status(st.session_state["batch_job"])
+    except Exception as e:
+        # An expired, deleted, or foreign job fails on every poll, so stop tracking it
+        job_name = st.session_state.pop("batch_job")
+        logging.error(f"Failed to get batch job {job_name}: {e}")
+        st.error(f"Could not check batch job {job_name}. Please queue your recipes again.")
+    else:
+        state = batch_job.state.name
+        if state in BATCH_DONE_STATES:
+            del st.session_state["batch_job"]
+            if state == "JOB_STATE_SUCCEEDED":
+                st.session_state["batch_results"] = provider.retrieve_batch_results(batch_job)
+            else:
+                st.error(f"Batch job {batch_job.name} ended with state {state}.")
+        else:
+            st.info(f"Batch job {batch_job.name} is {state}. Check back in a few minutes.")
+            st.button("Refresh batch status", key="refresh_batch")
+
+if st.session_state.get("batch_results"):
+    st.write("Your queued recipes:")
+    for i, result in enumerate(st.session_state["batch_results"], start=1):
+        with st.expander(f"Queued recipe {i}", expanded=i == 1):
+            render_recipes(result, st.session_state.get("batch_queries", []))
+
+# Generation blocks the script until the model finishes, so it runs last:
+# the prompt tab and the batch status above are already on the page.
+if recipes_tab is not None:
+    with recipes_tab, st.spinner("Generating your recipes using Gemini..."):
+        try:
+            generate_recipe(prompt, tuple(queries), num_drafts, max_output_tokens)
+        except EmptyResponseError:
+            st.warning("No response generated. Please try adjusting your inputs.")
@@ -0,0 +1,296 @@
+import logging
+import os
+from typing import AsyncIterator, Protocol, runtime_checkable
+
+import streamlit as st
+
+# Shared generation settings; chef.py asks the model to end its answer with RECIPES_END
+TEMPERATURE = 0.8
+MAX_OUTPUT_TOKENS = 2048
+# Prompts that batch several cuisine/diet combinations; gemini-1.5-flash and gemini-2.0-flash accept up to 8192
+MAX_BATCHED_OUTPUT_TOKENS = 8192
+RECIPES_END = "---END---"
+
+# Harm categories left unblocked; both SDKs accept the same enum names
+SAFETY_CATEGORIES = (
+    "HARM_CATEGORY_HARASSMENT",
+    "HARM_CATEGORY_HATE_SPEECH",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    "HARM_CATEGORY_DANGEROUS_CONTENT",
+)
+SAFETY_THRESHOLD = "BLOCK_NONE"
+
+VERTEX_MODEL = "gemini-2.0-flash-001"
+
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+class Provider(Protocol):
+    """The Gemini calls chef.py needs, independent of the SDK behind them."""
+
+    model_name: str
+    description: str
+
+    def stream(self, prompt: str, num_drafts: int, max_output_tokens: int) -> AsyncIterator[str]:
+        """Streams the text of a single response, chunk by chunk."""
+
+    async def drafts(self, prompt: str, num_drafts: int, max_output_tokens: int) -> list[str]:
+        """Returns one text per candidate from a single request."""
+
+
+@runtime_checkable
+class BatchProvider(Protocol):
+    """Optional Batch API capability; chef.py checks for it with isinstance."""
+
+    def submit_batch(self, prompts: list[str], num_drafts: int, max_output_tokens: int) -> str:
+        """Queues prompts as a Batch API job and returns the job name."""
+
+    def get_batch_status(self, job_name: str):
+        """Returns the current state of a batch job."""
+
+    def retrieve_batch_results(self, job) -> list[str]:
+        """Returns one text per candidate from a finished batch job."""
+
+
+def _candidate_text(candidate):
+    # google-genai leaves content (and parts) unset on blocked candidates
+    parts = candidate.content.parts if candidate.content else None
+    return "".join(part.text or "" for part in parts or [])
+
+
+# --- Public Gemini API (google-generativeai) ---
+# The SDK is imported inside these loaders so the Vertex AI deployment never loads it.
+@st.cache_resource
+def configure_client(api_key):
+    """
+    Configures the Gemini SDK once per process. genai.configure drops the
+    SDK's cached gRPC clients, so calling it on every rerun would rebuild them.
+    """
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    logging.info("Gemini API Key loaded from environment variable.")
+
+# Generation config (without safety_settings), built once per draft count and token budget
+@st.cache_resource
+def get_generation_config(num_drafts, max_output_tokens=MAX_OUTPUT_TOKENS):
+    """
+    Returns the shared GenerationConfig for the requested number of drafts
+    and output token budget.
+    """
+    from google.generativeai.types import GenerationConfig
+
+    return GenerationConfig(
+        candidate_count=num_drafts,
+        stop_sequences=[RECIPES_END],
+        temperature=TEMPERATURE,
+        max_output_tokens=max_output_tokens
+    )
+
+# Safety settings defined separately, built once per process
+@st.cache_resource
+def get_safety_settings():
+    """
+    Returns the shared safety settings bound to the model.
+    """
+    from google.generativeai.types import HarmBlockThreshold, HarmCategory
+
+    return tuple(
+        {"category": HarmCategory[category], "threshold": HarmBlockThreshold[SAFETY_THRESHOLD]}
+        for category in SAFETY_CATEGORIES
+    )
+
+# Preferred model first
+MODEL_CANDIDATES = ("models/gemini-1.5-flash-latest", "models/gemini-pro")
+
+@st.cache_resource
+def available_models():
+    """
+    Lists the models this API key can call generateContent on, once per
+    process. GenerativeModel does not check that a model exists until the
+    first request, so load_models picks from this list instead.
+    """
+    import google.generativeai as genai
+
+    return {
+        model.name for model in genai.list_models()
+        if "generateContent" in model.supported_generation_methods
+    }
+
+@st.cache_resource
+def load_models():
+    """
+    Loads the Gemini generative model. Prefers gemini-1.5-flash-latest,
+    falls back to gemini-pro if the preferred model is not available.
+    The safety settings are bound to the model here so requests don't pass
+    them; the generation config is passed per request.
+    """
+    import google.generativeai as genai
+
+    try:
+        models = available_models()
+    except Exception as e:
+        logging.error(f"Failed to list models: {e}. No generative model could be loaded.")
+        st.error("Could not load a generative model. Please check your API key and model availability.")
+        st.stop()
+
+    for model_name in MODEL_CANDIDATES:
+        if model_name in models:
+            logging.info(f"Successfully loaded model: {model_name}")
+            return genai.GenerativeModel(model_name, safety_settings=get_safety_settings())
+        logging.warning(f"{model_name} is not available, trying the next model.")
+
+    logging.error("None of the preferred models are available. No generative model could be loaded.")
+    st.error("Could not load a generative model. Please check your API key and model availability.")
+    st.stop()
+
+@st.cache_resource
+def load_batch_client(api_key):
+    """
+    Loads the Gen AI client used to submit and poll Batch API jobs. The SDK
+    is only needed in batch mode, so it is imported on first use.
+    """
+    from google import genai as google_genai
+
+    return google_genai.Client(api_key=api_key)
+
+
+class PublicProvider:
+    """Public Gemini API through google-generativeai, authenticated with GEMINI_API_KEY."""
+
+    description = "public API"
+
+    def __init__(self):
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            st.error("Gemini API Key not found. Please set 'GEMINI_API_KEY' as an environment variable.")
+            st.stop()
+        configure_client(api_key)
+        self._api_key = api_key
+        self._model = load_models()
+        self.model_name = self._model.model_name
+
+    async def stream(self, prompt, num_drafts, max_output_tokens):
+        responses = await self._model.generate_content_async(
+            prompt,
+            generation_config=get_generation_config(num_drafts, max_output_tokens),
+            stream=True
+        )
+        async for response in responses:
+            # .text raises ValueError on empty or safety-filtered chunks, so check for parts first
+            if response.candidates and response.candidates[0].content.parts:
+                yield response.text
+
+    async def drafts(self, prompt, num_drafts, max_output_tokens):
+        response = await self._model.generate_content_async(
+            prompt,
+            generation_config=get_generation_config(num_drafts, max_output_tokens)
+        )
+        return [_candidate_text(candidate) for candidate in response.candidates]
+
+    def submit_batch(self, prompts, num_drafts, max_output_tokens):
+        batch_config = {
+            "candidate_count": num_drafts,
+            "stop_sequences": [RECIPES_END],
+            "temperature": TEMPERATURE,
+            "max_output_tokens": max_output_tokens,
+            "safety_settings": [
+                {"category": category, "threshold": SAFETY_THRESHOLD} for category in SAFETY_CATEGORIES
+            ]
+        }
+        requests = [
+            {"contents": [{"role": "user", "parts": [{"text": prompt}]}], "config": batch_config}
+            for prompt in prompts
+        ]
+        job = load_batch_client(self._api_key).batches.create(
+            model=self.model_name,
+            src=requests,
+            config={"display_name": "ai-chef-recipes"}
+        )
+        return job.name
+
+    def get_batch_status(self, job_name):
+        return load_batch_client(self._api_key).batches.get(name=job_name)
+
+    def retrieve_batch_results(self, job):
+        results = []
+        for inlined_response in job.dest.inlined_responses or []:
+            if inlined_response.error or not inlined_response.response:
+                continue
+            for candidate in inlined_response.response.candidates or []:
+                # Blocked candidates come back without content or parts
+                if candidate.content and candidate.content.parts:
+                    results.append(_candidate_text(candidate))
+        return results
+
+
+# --- Gemini API in Vertex AI (google-genai) ---
+@st.cache_resource
+def load_vertex_client():
+    """
+    Loads the Gen AI client for Vertex AI from GOOGLE_CLOUD_PROJECT and
+    GOOGLE_CLOUD_REGION. The SDK is imported here so the public API
+    deployment never loads it.
+    """
+    from google import genai as google_genai
+
+    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    location = os.environ.get("GOOGLE_CLOUD_REGION", "us-central1")
+    if not project_id:
+        st.error("Google Cloud project not found. Please set 'GOOGLE_CLOUD_PROJECT' as an environment variable.")
+        st.stop()
+    return google_genai.Client(vertexai=True, project=project_id, location=location)
+
+@st.cache_resource
+def get_vertex_generation_config(num_drafts, max_output_tokens=MAX_OUTPUT_TOKENS):
+    """
+    Returns the shared GenerateContentConfig, safety settings included, for
+    the requested number of drafts and output token budget.
+    """
+    from google.genai.types import GenerateContentConfig, SafetySetting
+
+    return GenerateContentConfig(
+        candidate_count=num_drafts,
+        stop_sequences=[RECIPES_END],
+        temperature=TEMPERATURE,
+        max_output_tokens=max_output_tokens,
+        safety_settings=[
+            SafetySetting(category=category, threshold=SAFETY_THRESHOLD) for category in SAFETY_CATEGORIES
+        ]
+    )
+
+
+class VertexProvider:
+    """Gemini API in Vertex AI through google-genai, authenticated with Application Default Credentials."""
+
+    description = "Vertex AI"
+    # Not a BatchProvider: Vertex AI batch jobs read from Cloud Storage or BigQuery, not inline requests
+
+    def __init__(self):
+        self._client = load_vertex_client()
+        self.model_name = VERTEX_MODEL
+
+    async def stream(self, prompt, num_drafts, max_output_tokens):
+        responses = await self._client.aio.models.generate_content_stream(
+            model=self.model_name,
+            contents=prompt,
+            config=get_vertex_generation_config(num_drafts, max_output_tokens)
+        )
+        async for response in responses:
+            if response.text:
+                yield response.text
+
+    async def drafts(self, prompt, num_drafts, max_output_tokens):
+        response = await self._client.aio.models.generate_content(
+            model=self.model_name,
+            contents=prompt,
+            config=get_vertex_generation_config(num_drafts, max_output_tokens)
+        )
+        return [_candidate_text(candidate) for candidate in response.candidates or []]
+
+
+def load_provider() -> Provider:
+    """Picks the Vertex AI provider when USE_VERTEX is set, the public API otherwise."""
+    if os.environ.get("USE_VERTEX"):
+        return VertexProvider()
+    return PublicProvider()